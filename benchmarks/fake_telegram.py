@@ -0,0 +1,123 @@
+import asyncio
+import io
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+from tikdog.telegram import Telegram
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    text: str | None = None
+
+
+@dataclass
+class FakeUser:
+    id: int = 1
+    username: str = "fake_tikdog_bot"
+
+
+@dataclass
+class FakeChannel:
+    id: int
+
+
+@dataclass
+class FakeTelegramClient:
+    # Stand-in for TelegramClient, implementing just what Telegram uses
+    latency_sec: float = 0.0
+    # channel ID -> message ID -> message
+    channels: dict[int, dict[int, FakeMessage]] = field(default_factory=dict)
+    last_ids: dict[int, int] = field(default_factory=dict)
+    requests: Counter = field(default_factory=Counter)
+    uploaded_files: int = 0
+    uploaded_bytes: int = 0
+
+    def messages(self, channel_id: int) -> dict[int, FakeMessage]:
+        if channel_id not in self.channels:
+            # Channel creation service message, every real channel starts with one
+            self.channels[channel_id] = {1: FakeMessage(id=1)}
+            self.last_ids[channel_id] = 1
+        return self.channels[channel_id]
+
+    def _new_message(self, channel_id: int, text: str | None) -> FakeMessage:
+        messages = self.messages(channel_id)
+        self.last_ids[channel_id] += 1
+        msg = FakeMessage(id=self.last_ids[channel_id], text=text)
+        messages[msg.id] = msg
+        return msg
+
+    async def _call(self, name: str) -> None:
+        self.requests[name] += 1
+        if self.latency_sec:
+            await asyncio.sleep(self.latency_sec)
+
+    def seed(self, channel_id: int, tiktok_ids: list[int]) -> None:
+        # Pretend these were already posted by the dog, oldest first
+        for id_ in tiktok_ids:
+            self._new_message(
+                channel_id,
+                f"{Telegram.TEMPLATE_POST_ID[0]}{id_}{Telegram.TEMPLATE_POST_ID[1]}\n"
+                f"{Telegram.TEMPLATE_LINK[0]}https://www.tiktok.com/@uSeRnAmE/video/{id_}{Telegram.TEMPLATE_LINK[1]}\n"
+                f"{Telegram.TEMPLATE_LIKED[0]}True{Telegram.TEMPLATE_LIKED[1]}\n"
+                f"{Telegram.TEMPLATE_FAVORITED[0]}False{Telegram.TEMPLATE_FAVORITED[1]}",
+            )
+
+    def posted(self, channel_id: int) -> int:
+        # Messages with a post caption
+        return sum(1 for m in self.messages(channel_id).values() if m.text and Telegram.TEMPLATE_POST_ID[0] in m.text)
+
+    def read_upload(self, file: Any) -> int:
+        # Consume the file the same way an upload would
+        if isinstance(file, (bytes, bytearray)):
+            return len(file)
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "rb") as inf:
+                return len(inf.read())
+        if isinstance(file, io.IOBase):
+            return len(file.read())
+        raise TypeError(f"Unsupported upload type: {type(file)}")
+
+    async def start(self, bot_token: str | None = None) -> "FakeTelegramClient":
+        await self._call("start")
+        return self
+
+    async def get_me(self) -> FakeUser:
+        await self._call("get_me")
+        return FakeUser()
+
+    async def get_entity(self, entity: int) -> FakeChannel:
+        await self._call("get_entity")
+        return FakeChannel(id=entity)
+
+    async def get_messages(self, entity: FakeChannel, ids: int) -> FakeMessage | None:
+        await self._call("get_messages")
+        return self.messages(entity.id).get(ids)
+
+    async def send_message(self, entity: FakeChannel, message: str, silent: bool = False) -> FakeMessage:
+        await self._call("send_message")
+        return self._new_message(entity.id, message)
+
+    async def delete_messages(self, entity: FakeChannel, message_ids: int | list[int]) -> None:
+        await self._call("delete_messages")
+        if isinstance(message_ids, int):
+            message_ids = [message_ids]
+        for id_ in message_ids:
+            self.messages(entity.id).pop(id_, None)
+
+    async def send_file(
+        self, entity: FakeChannel, file: Any, caption: str | None = None, **kwargs: Any
+    ) -> FakeMessage | list[FakeMessage]:
+        await self._call("send_file")
+        files = file if isinstance(file, list) else [file]
+        if not files:
+            raise ValueError("Nothing to send")
+        sent = []
+        for num, f in enumerate(files):
+            self.uploaded_bytes += self.read_upload(f)
+            self.uploaded_files += 1
+            sent.append(self._new_message(entity.id, caption if num == 0 else None))
+        return sent if isinstance(file, list) else sent[0]
@@ -0,0 +1,378 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs
+
+import httpx
+from mutagen.id3 import ID3, TIT2
+
+# Everything the dog talks to, routed by host
+WEB_HOST = "www.tiktok.com"
+MOBILE_HOST = "api22-normal-c-useast2a.tiktokv.com"
+VIDEO_CDN_HOSTS = ("v16-webapp-prime.tiktok.com", "v19-webapp-prime.us.tiktok.com")
+IMAGE_CDN_HOSTS = ("p16-sign-va.tiktokcdn.com", "p19-sign.tiktokcdn-us.com")
+MUSIC_CDN_HOST = "sf16-ies-music-va.tiktokcdn.com"
+
+BASE_ID = 7_400_000_000_000_000_000
+# Posts the dog checks on startup
+FISCH_ID = 7455398333754952967
+KITTY_ID = 7651360277778255111
+
+SEC_UID = "MS4wLjABAAAA-fake-sec-uid"
+WAF_COOKIE_NAME = "_wafchallengeid"
+
+# Video variants, as listed in the item payload
+GEARS = (
+    ("normal_1080_0", 1080, 1920, 2_400_000),
+    ("normal_720_0", 720, 1280, 1_200_000),
+    ("normal_540_0", 540, 960, 650_000),
+)
+
+
+def _mp3_blob(size: int) -> bytes:
+    # Mutagen refuses to tag anything that doesn't look like a real MP3, so provide a
+    # few MPEG-1 Layer III frames (128 kbps, 44.1 kHz) behind an ID3 tag
+    frame = b"\xff\xfb\x90\x64" + b"\x00" * 413
+    buf = io.BytesIO()
+    tag = ID3()
+    tag.add(TIT2(encoding=3, text="fake"))
+    tag.save(buf)
+    buf.write(frame * max(4, size // len(frame)))
+    return buf.getvalue()
+
+
+@dataclass
+class FakeTikTokConfig:
+    # Amount of liked posts per account. Favorited are a subset of them.
+    posts: int = 1000
+    accounts: int = 1
+    page_size: int = 20
+    # Every n-th post is a photo slideshow / copyrighted video / favorited one
+    photo_every: int = 7
+    copyrighted_every: int = 50
+    favorited_every: int = 5
+    images_per_photo: int = 4
+    # Every n-th web request hits the WAF. 0 disables it.
+    waf_every: int = 25
+    # Upper bound for the challenge solution, the real one is up to 1_000_000
+    waf_difficulty: int = 2000
+    video_size: int = 16 * 1024
+    image_size: int = 4 * 1024
+    music_size: int = 8 * 1024
+    # Throttling: fixed latency per request and CDN bandwidth (bytes/sec). 0 disables.
+    latency_sec: float = 0.0
+    bandwidth: int = 0
+    # Mirrors, whose responses are garbage (HTML stub instead of media)
+    broken_hosts: tuple[str, ...] = ()
+    # Extra latency for specific hosts
+    host_latency_sec: dict[str, float] = field(default_factory=dict)
+    # The n-th liked feed request fails with 500 (only once). 0 disables it.
+    fail_liked_page: int = 0
+
+
+@dataclass
+class FakeTikTok:
+    config: FakeTikTokConfig = field(default_factory=FakeTikTokConfig)
+    requests: Counter = field(default_factory=Counter)
+    bytes_sent: int = 0
+
+    def __post_init__(self) -> None:
+        # The best quality is the default stream, the others get smaller
+        self.video_blobs = {
+            gear: os.urandom(self.config.video_size * (len(GEARS) - num)) for num, (gear, *_) in enumerate(GEARS)
+        }
+        self.image_blob = os.urandom(self.config.image_size)
+        self.music_blob = _mp3_blob(self.config.music_size)
+        self.total_posts = self.config.posts * self.config.accounts
+        # username -> account number, in order of appearance
+        self.users: dict[str, int] = {}
+        self._web_requests = 0
+        self._liked_requests = 0
+
+    # Post generation
+    def post_id(self, index: int) -> int:
+        # Index 0 is the newest post of the first account
+        return BASE_ID + self.total_posts - index
+
+    def post_index(self, id_: int) -> int:
+        return BASE_ID + self.total_posts - id_
+
+    def liked(self, account: int) -> list[int]:
+        return list(range(account * self.config.posts, (account + 1) * self.config.posts))
+
+    def favorited(self, account: int) -> list[int]:
+        return [i for i in self.liked(account) if i % self.config.favorited_every == 0]
+
+    def is_photo(self, id_: int) -> bool:
+        return id_ != FISCH_ID and id_ != KITTY_ID and self.post_index(id_) % self.config.photo_every == 3
+
+    def is_copyrighted(self, id_: int) -> bool:
+        if id_ == FISCH_ID or id_ == KITTY_ID:
+            return id_ == KITTY_ID
+        return self.post_index(id_) % self.config.copyrighted_every == 11
+
+    def item(self, id_: int) -> dict:
+        item = {
+            "id": str(id_),
+            "desc": f"post number {id_} #fyp #foryou #cat",
+            "createTime": 1_700_000_000 + id_ % 100_000_000,
+            "author": {
+                "id": str(6_800_000_000_000_000_000 + id_ % 1000),
+                "uniqueId": f"author{id_ % 1000}",
+                "nickname": f"Author {id_ % 1000}",
+                "avatarThumb": f"https://{IMAGE_CDN_HOSTS[0]}/avatar/{id_ % 1000}.jpeg",
+                "signature": "just a fake account " * 3,
+                "verified": False,
+            },
+            "stats": {
+                "diggCount": id_ % 100_000,
+                "shareCount": id_ % 1000,
+                "commentCount": id_ % 5000,
+                "playCount": id_ % 10_000_000,
+                "collectCount": str(id_ % 3000),
+            },
+            "music": {
+                "id": str(id_ + 1),
+                "title": f"original sound - author{id_ % 1000}",
+                "authorName": f"Author {id_ % 1000}",
+                "coverLarge": f"https://{MUSIC_CDN_HOST}/cover/{id_}.jpeg",
+                "playUrl": f"https://{MUSIC_CDN_HOST}/obj/{id_}.mp3?mime_type=audio_mpeg",
+                "duration": 30,
+            },
+            "textExtra": [{"hashtagName": t, "type": 1} for t in ("fyp", "foryou", "cat")],
+        }
+        if self.is_photo(id_):
+            item["imagePost"] = {
+                "images": [
+                    {
+                        "imageURL": {
+                            "urlList": [f"https://{host}/img/{id_}/{num}.jpeg" for host in IMAGE_CDN_HOSTS],
+                        },
+                        "imageWidth": 1080,
+                        "imageHeight": 1440,
+                    }
+                    for num in range(self.config.images_per_photo)
+                ],
+                "title": "",
+            }
+            item["video"] = {"duration": 0, "width": 1080, "height": 1440}
+            return item
+        variants = [
+            {
+                "GearName": gear,
+                "QualityType": 10 + num,
+                "Bitrate": bitrate,
+                "CodecType": "h264",
+                "PlayAddr": {
+                    "DataSize": len(self.video_blobs[gear]),
+                    "Width": width,
+                    "Height": height,
+                    "Uri": f"v12044gd0000{id_}",
+                    "UrlKey": f"v12044gd0000{id_}_h264_{height}p_{bitrate}",
+                    "UrlList": [f"https://{host}/video/{id_}/{gear}.mp4" for host in VIDEO_CDN_HOSTS],
+                },
+            }
+            for num, (gear, width, height, bitrate) in enumerate(GEARS)
+        ]
+        item["video"] = {
+            "id": str(id_),
+            "height": 1280,
+            "width": 720,
+            "duration": 15,
+            "ratio": "720p",
+            "format": "mp4",
+            "cover": f"https://{IMAGE_CDN_HOSTS[0]}/cover/{id_}.jpeg",
+            "bitrateInfo": variants,
+            "playAddr": ""
+            if self.is_copyrighted(id_)
+            else f"https://{VIDEO_CDN_HOSTS[0]}/video/{id_}/{GEARS[0][0]}.mp4",
+            "downloadAddr": "",
+        }
+        return item
+
+    def mobile_item(self, id_: int) -> dict:
+        return {
+            "aweme_id": str(id_),
+            "desc": f"post number {id_}",
+            "video": {
+                "play_addr": {
+                    "url_list": [f"https://{host}/video/{id_}/{GEARS[0][0]}.mp4" for host in VIDEO_CDN_HOSTS],
+                    "data_size": len(self.video_blobs[GEARS[0][0]]),
+                    "width": GEARS[0][1],
+                    "height": GEARS[0][2],
+                },
+                "bit_rate": [
+                    {
+                        "gear_name": gear,
+                        "bit_rate": bitrate,
+                        "play_addr": {
+                            "url_list": [f"https://{host}/video/{id_}/{gear}.mp4" for host in VIDEO_CDN_HOSTS],
+                            "data_size": len(self.video_blobs[gear]),
+                            "width": width,
+                            "height": height,
+                        },
+                    }
+                    for gear, width, height, bitrate in GEARS
+                ],
+            },
+        }
+
+    # WAF
+    def waf_challenge(self) -> httpx.Response:
+        solution = self._web_requests % self.config.waf_difficulty
+        prefix = os.urandom(16)
+        c = {
+            "v": {
+                "a": base64.b64encode(prefix).decode(),
+                "c": base64.b64encode(hashlib.sha256(prefix + str(solution).encode()).digest()).decode(),
+            },
+            "s": solution,
+        }
+        cs = base64.b64encode(json.dumps(c).encode()).decode().rstrip("=")
+        html = (
+            "<html><head><title>SlardarWAF</title></head><body>"
+            f'<p id="wci" class="{WAF_COOKIE_NAME}"></p>'
+            f'<p id="cs" class="{cs}"></p>'
+            '<p id="rci" class="_wafchallengeid_r"></p><p id="rs" class="ok"></p>'
+            "</body></html>"
+        )
+        return httpx.Response(200, headers={"Content-Type": "text/html; charset=utf-8"}, text=html)
+
+    def waf_passed(self, request: httpx.Request) -> bool:
+        m = re.search(rf"{WAF_COOKIE_NAME}=([^;]+)", request.headers.get("Cookie", ""))
+        if not m:
+            return False
+        try:
+            c = json.loads(base64.b64decode(m.group(1)))
+            return base64.b64decode(c["d"]).decode() == str(c["s"])
+        except Exception:
+            return False
+
+    # Routes
+    def account(self, request: httpx.Request) -> int:
+        sec_uid = parse_qs(request.url.query.decode())["secUid"][0]
+        return int(sec_uid.rsplit("-", 1)[1])
+
+    def feed(self, indexes: list[int], request: httpx.Request) -> httpx.Response:
+        params = parse_qs(request.url.query.decode())
+        cursor = int(params.get("cursor", ["0"])[0])
+        count = int(params.get("count", [str(self.config.page_size)])[0])
+        page = indexes[cursor : cursor + count]
+        data = {
+            "statusCode": 0,
+            "cursor": cursor + len(page),
+            "hasMore": cursor + len(page) < len(indexes),
+            "itemList": [self.item(self.post_id(i)) for i in page],
+        }
+        return httpx.Response(200, json=data)
+
+    def video_page(self, id_: int) -> httpx.Response:
+        data = {
+            "__DEFAULT_SCOPE__": {
+                "webapp.app-context": {"region": "US", "language": "en"},
+                "webapp.video-detail": {
+                    "itemInfo": {"itemStruct": self.item(id_)},
+                    "shareMeta": {"title": f"post number {id_}", "desc": ""},
+                    "statusCode": 0,
+                },
+            }
+        }
+        html = (
+            "<!DOCTYPE html><html><head><title>TikTok</title></head><body>"
+            + "<div>" * 50
+            + "</div>" * 50
+            + '<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">'
+            + json.dumps(data)
+            + "</script></body></html>"
+        )
+        return httpx.Response(200, headers={"Content-Type": "text/html; charset=utf-8"}, text=html)
+
+    def web(self, request: httpx.Request) -> httpx.Response:
+        self._web_requests += 1
+        waf_every = self.config.waf_every
+        if waf_every and self._web_requests % waf_every == 0 and not self.waf_passed(request):
+            self.requests["waf"] += 1
+            return self.waf_challenge()
+        path = request.url.path
+        if path == "/api/favorite/item_list/":
+            self.requests["feed_liked"] += 1
+            self._liked_requests += 1
+            if self._liked_requests == self.config.fail_liked_page:
+                return httpx.Response(500)
+            return self.feed(self.liked(self.account(request)), request)
+        if path == "/api/user/collect/item_list/":
+            self.requests["feed_favorite"] += 1
+            return self.feed(self.favorited(self.account(request)), request)
+        if m := re.fullmatch(r"/@[^/]+/video/(\d+)", path):
+            self.requests["video_page"] += 1
+            return self.video_page(int(m.group(1)))
+        if re.fullmatch(r"/@[^/]+", path):
+            self.requests["user_page"] += 1
+            account = self.users.setdefault(path[2:], len(self.users))
+            if account >= self.config.accounts:
+                return httpx.Response(404)
+            return httpx.Response(
+                200, headers={"Content-Type": "text/html"}, text=f'{{"secUid":"{SEC_UID}-{account}"}}'
+            )
+        self.requests["not_found"] += 1
+        return httpx.Response(404)
+
+    def mobile(self, request: httpx.Request) -> httpx.Response:
+        self.requests["mobile"] += 1
+        id_ = int(parse_qs(request.url.query.decode())["aweme_id"][0])
+        return httpx.Response(200, json={"status_code": 0, "aweme_list": [self.mobile_item(id_)]})
+
+    def cdn(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.requests[f"cdn:{host}"] += 1
+        if host in self.config.broken_hosts:
+            return httpx.Response(200, headers={"Content-Type": "text/html"}, text="<html>nope</html>")
+        path = request.url.path
+        if host == MUSIC_CDN_HOST:
+            if path.startswith("/cover/"):
+                return httpx.Response(200, headers={"Content-Type": "image/jpeg"}, content=self.image_blob)
+            return httpx.Response(200, headers={"Content-Type": "audio/mpeg"}, content=self.music_blob)
+        if host in IMAGE_CDN_HOSTS:
+            return httpx.Response(200, headers={"Content-Type": "image/jpeg"}, content=self.image_blob)
+        gear = path.rsplit("/", 1)[-1].removesuffix(".mp4")
+        if gear not in self.video_blobs:
+            return httpx.Response(404)
+        return httpx.Response(200, headers={"Content-Type": "video/mp4"}, content=self.video_blobs[gear])
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host == WEB_HOST:
+            resp = self.web(request)
+        elif host == MOBILE_HOST:
+            resp = self.mobile(request)
+        elif host in (*VIDEO_CDN_HOSTS, *IMAGE_CDN_HOSTS, MUSIC_CDN_HOST):
+            resp = self.cdn(request)
+        else:
+            self.requests["unknown_host"] += 1
+            resp = httpx.Response(404)
+        size = len(resp.content)
+        self.bytes_sent += size
+        delay = self.config.latency_sec + self.config.host_latency_sec.get(host, 0.0)
+        if self.config.bandwidth:
+            delay += size / self.config.bandwidth
+        if delay:
+            await asyncio.sleep(delay)
+        return resp
+
+    def transport(self) -> httpx.AsyncBaseTransport:
+        return FakeTikTokTransport(self)
+
+
+class FakeTikTokTransport(httpx.AsyncBaseTransport):
+    def __init__(self, server: FakeTikTok):
+        self.server = server
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return await self.server.handle(request)
@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import httpx
+
+from benchmarks.fake_telegram import FakeTelegramClient
+from benchmarks.fake_tiktok import FakeTikTok, FakeTikTokConfig
+from tikdog import watchdog
+from tikdog.bandwidth import BandwidthPolicy
+from tikdog.media import MediaStore
+from tikdog.supervisor import AccountConfig, SupervisorConfig, supervise
+from tikdog.storage import Storage
+from tikdog.structures import DownloadTask, ParsedTikTokPost
+from tikdog.telegram import Telegram
+from tikdog.tiktok import TikTok, create_client
+
+log = logging.getLogger("tikdog.bench")
+
+CHANNEL_ID = -1001234567890
+
+
+@dataclass
+class BenchOptions:
+    tg_latency_sec: float = 0.0
+    # In-memory media limit in bytes, 0 keeps everything on disk
+    media_memory: int = 0
+    race_mirrors: bool = False
+    bandwidth: BandwidthPolicy = field(default_factory=BandwidthPolicy)
+    post_download_concurrency: int = 4
+    download_concurrency: int = 8
+    accounts: int = 3
+    stream_posting: bool = False
+    trace_memory: bool = True
+
+
+@dataclass
+class Result:
+    scenario: str
+    posts: int
+    seconds: float
+    peak_mib: float
+    tiktok_requests: Counter = field(default_factory=Counter)
+    telegram_requests: Counter = field(default_factory=Counter)
+    tiktok_bytes: int = 0
+    telegram_bytes: int = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.posts / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "scenario": self.scenario,
+            "posts": self.posts,
+            "seconds": round(self.seconds, 3),
+            "posts_per_sec": round(self.throughput, 1),
+            "peak_mib": round(self.peak_mib, 2),
+            "tiktok_requests": dict(self.tiktok_requests),
+            "telegram_requests": dict(self.telegram_requests),
+            "tiktok_bytes": self.tiktok_bytes,
+            "telegram_bytes": self.telegram_bytes,
+        }
+
+
+def make_dog(
+    server: FakeTikTok, client: FakeTelegramClient, options: BenchOptions, storage: Storage | None = None
+) -> tuple[Storage, TikTok, Telegram]:
+    if storage is None:
+        storage = Storage()
+    media = MediaStore(memory_limit=options.media_memory)
+    tt = TikTok("bench", "sessionid=bench", "7000000000000000000", storage, transport=server.transport(), media=media)
+    tt.request_delay_sec = 0
+    watchdog.tune(
+        tt,
+        options.race_mirrors,
+        options.bandwidth,
+        options.post_download_concurrency,
+        asyncio.Semaphore(options.download_concurrency),
+    )
+    tg = Telegram(0, "bench", "bench", CHANNEL_ID, storage, client=client, media=media)  # type: ignore
+    return storage, tt, tg
+
+
+async def measure(
+    scenario: str,
+    posts: int,
+    server: FakeTikTok,
+    client: FakeTelegramClient,
+    run: Callable[[], Awaitable[None]],
+    trace_memory: bool,
+) -> Result:
+    server.requests.clear()
+    client.requests.clear()
+    tt_bytes = server.bytes_sent
+    tg_bytes = client.uploaded_bytes
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    await run()
+    seconds = time.perf_counter() - started
+    peak = 0
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return Result(
+        scenario=scenario,
+        posts=posts,
+        seconds=seconds,
+        peak_mib=peak / 1024 / 1024,
+        tiktok_requests=server.requests.copy(),
+        telegram_requests=client.requests.copy(),
+        tiktok_bytes=server.bytes_sent - tt_bytes,
+        telegram_bytes=client.uploaded_bytes - tg_bytes,
+    )
+
+
+async def bench_tiktok(config: FakeTikTokConfig, options: BenchOptions) -> Result:
+    server = FakeTikTok(config)
+    client = FakeTelegramClient(latency_sec=options.tg_latency_sec)
+    storage, tt, _ = make_dog(server, client, options)
+    await tt.connect()
+    result = await measure("tiktok.update_data", config.posts, server, client, tt.update_data, options.trace_memory)
+    assert len(storage) == config.posts, f"expected {config.posts} posts, got {len(storage)}"
+    return result
+
+
+async def bench_telegram(config: FakeTikTokConfig, options: BenchOptions) -> Result:
+    server = FakeTikTok(config)
+    client = FakeTelegramClient(latency_sec=options.tg_latency_sec)
+    ids = [server.post_id(i) for i in range(config.posts)]
+    client.seed(CHANNEL_ID, ids[::-1])
+    storage = Storage()
+    storage.add(
+        [
+            ParsedTikTokPost(
+                id_=id_,
+                type_="video",
+                web_url=f"https://www.tiktok.com/@uSeRnAmE/video/{id_}",
+                media=[DownloadTask(post_id=id_, type_="video", number=0, download_url="")],
+            )
+            for id_ in ids
+        ]
+    )
+    _, _, tg = make_dog(server, client, options, storage)
+    await tg.connect()
+
+    async def run() -> None:
+        await tg.update_data(max_count=0, reverse=True, determine_last_id=True)
+
+    result = await measure("telegram.update_data", config.posts, server, client, run, options.trace_memory)
+    unposted = len(storage.unposted())
+    assert not unposted, f"{unposted} posts were not linked with Telegram"
+    return result
+
+
+async def bench_dog(config: FakeTikTokConfig, options: BenchOptions) -> Result:
+    server = FakeTikTok(config)
+    client = FakeTelegramClient(latency_sec=options.tg_latency_sec)
+    storage, tt, tg = make_dog(server, client, options)
+
+    async def run() -> None:
+        await watchdog.walk(storage, tt, tg, rounds=1, stream=options.stream_posting)
+
+    result = await measure("dog", config.posts, server, client, run, options.trace_memory)
+    assert len(storage) == config.posts, f"expected {config.posts} posts, got {len(storage)}"
+    unposted = len(storage.unposted())
+    assert not unposted, f"{unposted} posts were not posted"
+    return result
+
+
+async def bench_resume(config: FakeTikTokConfig, options: BenchOptions) -> Result:
+    # The liked feed fails halfway through the first fetch, the next round has to continue from there
+    config.fail_liked_page = max(2, config.posts // config.page_size // 2)
+    server = FakeTikTok(config)
+    client = FakeTelegramClient(latency_sec=options.tg_latency_sec)
+    storage, tt, tg = make_dog(server, client, options)
+
+    async def run() -> None:
+        await tt.connect()
+        try:
+            await tt.update_data()
+        except httpx.HTTPStatusError:
+            pass
+        else:
+            raise AssertionError("the liked feed hasn't failed")
+        assert 0 < len(storage) < config.posts, f"expected a partial fetch, got {len(storage)} posts"
+        assert tt.resume_cursors, "unfinished fetch isn't remembered"
+        await watchdog.walk(storage, tt, tg, rounds=1, stream=options.stream_posting)
+
+    result = await measure("resume", config.posts, server, client, run, options.trace_memory)
+    assert len(storage) == config.posts, f"expected {config.posts} posts, got {len(storage)}"
+    ids = [p.tiktok_id for p in storage]
+    assert ids == sorted(ids, reverse=True), "posts are not in new -> old order"
+    favorited = sum(p.favorited for p in storage)
+    expected = len(server.favorited(0))
+    assert favorited == expected, f"expected {expected} favorited posts, got {favorited}"
+    unposted = len(storage.unposted())
+    assert not unposted, f"{unposted} posts were not posted"
+    return result
+
+
+async def bench_supervisor(config: FakeTikTokConfig, options: BenchOptions) -> Result:
+    # Same amount of posts, split between accounts
+    total = config.posts
+    config.accounts = options.accounts
+    config.posts = total // options.accounts
+    server = FakeTikTok(config)
+    client = FakeTelegramClient(latency_sec=options.tg_latency_sec)
+    supervisor_config = SupervisorConfig(
+        app_id=0,
+        app_hash="bench",
+        bot_token="bench",
+        accounts=[
+            AccountConfig(username=f"bench{k}", cookie="sessionid=bench", device_id="7000000000000000000", channel_id=k)
+            for k in range(options.accounts)
+        ],
+        media_memory_limit=options.media_memory,
+        request_delay_sec=0,
+        stream_posting=options.stream_posting,
+        race_mirrors=options.race_mirrors,
+        max_bytes_per_sec=options.bandwidth.max_bytes_per_sec,
+        daily_quota=options.bandwidth.daily_quota,
+        max_resolution=options.bandwidth.max_resolution,
+        max_file_size=options.bandwidth.max_file_size,
+        post_download_concurrency=options.post_download_concurrency,
+        download_concurrency=options.download_concurrency,
+    )
+
+    async def run() -> None:
+        async with create_client(server.transport()) as http:
+            await supervise(supervisor_config, http, client, rounds=1)  # type: ignore
+
+    result = await measure("supervisor", total, server, client, run, options.trace_memory)
+    for account in supervisor_config.accounts:
+        posted = client.posted(account.channel_id)
+        assert posted == config.posts, f"{account.username}: expected {config.posts} posts, got {posted}"
+    return result
+
+
+SCENARIOS = {
+    "tiktok": bench_tiktok,
+    "telegram": bench_telegram,
+    "dog": bench_dog,
+    "supervisor": bench_supervisor,
+    "resume": bench_resume,
+}
+
+
+def format_counter(c: Counter) -> str:
+    return " ".join(f"{k}={v}" for k, v in sorted(c.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline tikdog benchmarks against local TikTok/Telegram stand-ins")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated post counts")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--waf-every", type=int, default=25, help="every n-th web request hits the WAF, 0 disables")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per TikTok request")
+    parser.add_argument("--tg-latency-ms", type=float, default=0.0, help="added latency per Telegram call")
+    parser.add_argument("--bandwidth-kib", type=int, default=0, help="CDN bandwidth in KiB/sec, 0 is unlimited")
+    parser.add_argument("--broken-hosts", default="", help="comma-separated CDN hosts returning garbage")
+    parser.add_argument(
+        "--slow-hosts", default="", help="comma-separated HOST=MS pairs of extra latency for specific hosts"
+    )
+    parser.add_argument("--race-mirrors", action="store_true", help="race the two best CDN mirrors")
+    parser.add_argument("--max-kib-per-sec", type=int, default=0, help="client-side download rate limit")
+    parser.add_argument("--max-resolution", type=int, default=0, help="preferred maximum video resolution")
+    parser.add_argument("--max-video-kib", type=int, default=0, help="maximum video size to pick a variant for")
+    parser.add_argument("--post-concurrency", type=int, default=4, help="concurrent downloads within a post")
+    parser.add_argument("--download-concurrency", type=int, default=8, help="concurrent downloads in total")
+    parser.add_argument("--accounts", type=int, default=3, help="accounts for the supervisor scenario")
+    parser.add_argument("--stream-posting", action="store_true", help="post while older pages are fetched")
+    parser.add_argument("--media-memory-mib", type=int, default=0, help="keep media in memory up to this size")
+    parser.add_argument("--no-memory", action="store_true", help="don't trace memory (faster, no peak numbers)")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger("tikdog").setLevel(logging.ERROR)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    log.setLevel(logging.INFO)
+    sizes = [int(s) for s in args.sizes.split(",")]
+    scenarios = args.scenarios.split(",")
+    broken_hosts = tuple(h for h in args.broken_hosts.split(",") if h)
+    host_latency_sec = {}
+    for pair in filter(None, args.slow_hosts.split(",")):
+        host, ms = pair.split("=")
+        host_latency_sec[host] = float(ms) / 1000
+    options = BenchOptions(
+        tg_latency_sec=args.tg_latency_ms / 1000,
+        media_memory=args.media_memory_mib * 1024 * 1024,
+        race_mirrors=args.race_mirrors,
+        post_download_concurrency=args.post_concurrency,
+        download_concurrency=args.download_concurrency,
+        accounts=args.accounts,
+        stream_posting=args.stream_posting,
+        bandwidth=BandwidthPolicy(
+            max_bytes_per_sec=args.max_kib_per_sec * 1024,
+            max_resolution=args.max_resolution,
+            max_file_size=args.max_video_kib * 1024,
+        ),
+        trace_memory=not args.no_memory,
+    )
+
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="tikdog-bench-") as workdir:
+        # Media lands in ./tmp, keep it out of the repository
+        os.chdir(workdir)
+        os.mkdir("tmp")
+        try:
+            for size in sizes:
+                for name in scenarios:
+                    config = FakeTikTokConfig(
+                        posts=size,
+                        waf_every=args.waf_every,
+                        latency_sec=args.latency_ms / 1000,
+                        bandwidth=args.bandwidth_kib * 1024,
+                        broken_hosts=broken_hosts,
+                        host_latency_sec=host_latency_sec,
+                    )
+                    bench = SCENARIOS[name]
+                    result = asyncio.run(bench(config, options))
+                    log.info(
+                        f"{result.scenario:<22} posts={result.posts:<7} {result.seconds:9.2f}s "
+                        f"{result.throughput:9.1f} posts/s peak={result.peak_mib:8.2f}MiB"
+                    )
+                    log.info(f"    tiktok:   {format_counter(result.tiktok_requests)} bytes={result.tiktok_bytes}")
+                    log.info(f"    telegram: {format_counter(result.telegram_requests)} bytes={result.telegram_bytes}")
+                    results.append(result)
+        finally:
+            os.chdir(cwd)
+
+    if args.json:
+        with open(args.json, "w") as outf:
+            json.dump([r.as_dict() for r in results], outf, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from tikdog.structures import VideoVariant
+
+
+class BandwidthPolicy:
+    # Limits how much and how fast media is downloaded, and which video quality is used.
+    # Zero means "no limit" for every setting.
+    def __init__(
+        self, max_bytes_per_sec: int = 0, daily_quota: int = 0, max_resolution: int = 0, max_file_size: int = 0
+    ):
+        self.log = logging.getLogger("tikdog.bandwidth")
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.daily_quota = daily_quota
+        self.max_resolution = max_resolution
+        self.max_file_size = max_file_size
+        self.day = datetime.date.today()
+        self.used_today = 0
+        # Expected sizes of downloads in progress, so concurrent ones don't overrun the quota together
+        self.reserved = 0
+        self.next_free = 0.0
+
+    def fits(self, variant: VideoVariant) -> bool:
+        if self.max_resolution and variant.resolution > self.max_resolution:
+            return False
+        if self.max_file_size and variant.size > self.max_file_size:
+            return False
+        return True
+
+    def pick_variant(self, variants: list[VideoVariant]) -> VideoVariant | None:
+        # None means "just use the default stream"
+        if not variants or not (self.max_resolution or self.max_file_size):
+            return None
+        fitting = [v for v in variants if self.fits(v)]
+        if self.max_file_size and any(v.size for v in fitting):
+            # Unknown size fits any limit, don't rely on it if there is a choice
+            fitting = [v for v in fitting if v.size]
+        if fitting:
+            return max(fitting, key=lambda v: (v.resolution, v.bitrate))
+        # Nothing fits, so at least get as close as possible
+        return min(variants, key=lambda v: (not v.size, v.size, v.bitrate))
+
+    def roll_day(self) -> None:
+        today = datetime.date.today()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def check(self, expected_size: int = 0) -> None:
+        # Reserves expected_size until release(), call it once the download is over
+        self.roll_day()
+        if self.daily_quota and self.used_today + self.reserved + expected_size > self.daily_quota:
+            raise RuntimeError(
+                f"Daily download quota exceeded ({self.used_today} of {self.daily_quota} bytes used, "
+                f"{self.reserved} in progress)"
+            )
+        self.reserved += expected_size
+
+    def release(self, expected_size: int = 0) -> None:
+        # The real size is counted by spend()
+        self.reserved -= expected_size
+
+    async def wait(self) -> None:
+        # Hold the next download until the previous ones fit into the rate limit
+        delay = self.next_free - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def spend(self, size: int) -> None:
+        self.roll_day()
+        self.used_today += size
+        if self.max_bytes_per_sec:
+            self.next_free = max(self.next_free, time.monotonic()) + size / self.max_bytes_per_sec
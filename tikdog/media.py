@@ -0,0 +1,94 @@
+import io
+import logging
+import os
+
+from tikdog.structures import DownloadTask
+
+
+class MediaStore:
+    # Keeps downloaded media between TikTok fetching and Telegram posting.
+    # Files are kept in memory while they fit into memory_limit (in bytes), everything
+    # else goes to data_dir. memory_limit == 0 means "always use disk".
+    def __init__(self, memory_limit: int = 0, data_dir: str = "tmp"):
+        self.log = logging.getLogger("tikdog.media")
+        self.memory_limit = memory_limit
+        self.data_dir = data_dir
+        self.memory_used = 0
+        # post ID -> filename -> content, None if it's on disk
+        self.files: dict[int, dict[str, bytes | None]] = {}
+        # post ID -> accounts that still need its files
+        self.holders: dict[int, set[str]] = {}
+
+    def hold(self, post_id: int, owner: str) -> None:
+        self.holders.setdefault(post_id, set()).add(owner)
+
+    def release(self, post_id: int, owner: str) -> bool:
+        # True if nobody else needs the post files, so they can be deleted
+        holders = self.holders.get(post_id, set())
+        holders.discard(owner)
+        if holders:
+            return False
+        self.holders.pop(post_id, None)
+        return True
+
+    def path(self, item: DownloadTask) -> str:
+        return f"{self.data_dir}/{item.filename}"
+
+    def fetched(self, item: DownloadTask) -> bool:
+        if item.filename in self.files.get(item.post_id, {}):
+            return True
+        if os.path.exists(self.path(item)):
+            # Leftover from the previous run, pick it up
+            self.files.setdefault(item.post_id, {})[item.filename] = None
+            return True
+        return False
+
+    def save(self, item: DownloadTask, data: bytes) -> None:
+        self.delete(item)
+        post_files = self.files.setdefault(item.post_id, {})
+        if self.memory_used + len(data) <= self.memory_limit:
+            post_files[item.filename] = data
+            self.memory_used += len(data)
+            return
+        if self.memory_limit:
+            self.log.debug(f"{item.filename} doesn't fit into memory, saving to disk")
+        with open(self.path(item), "wb") as outf:
+            outf.write(data)
+        post_files[item.filename] = None
+
+    def buffer(self, filename: str, data: bytes) -> io.BytesIO:
+        buf = io.BytesIO(data)
+        # Telethon guesses the media type from the name
+        buf.name = filename
+        return buf
+
+    def open(self, item: DownloadTask) -> str | io.BytesIO:
+        # Returns either a path or an in-memory file, both are accepted by mutagen and Telethon
+        data = self.files.get(item.post_id, {}).get(item.filename)
+        if data is None:
+            return self.path(item)
+        return self.buffer(item.filename, data)
+
+    def uploads(self, post_id: int) -> list[tuple[str, str | io.BytesIO]]:
+        # Everything fetched for the post, sorted by media number
+        post_files = self.files.get(post_id, {})
+        filenames = sorted(post_files, key=lambda s: int(s.split(".")[0].split("_")[1]))
+        uploads = []
+        for filename in filenames:
+            data = post_files[filename]
+            if data is None:
+                uploads.append((filename, f"{self.data_dir}/{filename}"))
+            else:
+                uploads.append((filename, self.buffer(filename, data)))
+        return uploads
+
+    def delete(self, item: DownloadTask) -> None:
+        post_files = self.files.get(item.post_id, {})
+        data = post_files.pop(item.filename, None)
+        if not post_files:
+            self.files.pop(item.post_id, None)
+        if data is not None:
+            # In-memory files never touch the disk
+            self.memory_used -= len(data)
+        elif os.path.exists(self.path(item)):
+            os.remove(self.path(item))
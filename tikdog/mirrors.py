@@ -0,0 +1,61 @@
+import logging
+import time
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+
+@dataclass
+class MirrorStats:
+    # Exponentially smoothed, so old measurements fade away
+    latency: float = 0.0
+    error_rate: float = 0.0
+    requests: int = 0
+    # time.monotonic() of the last error rate update
+    updated: float = 0.0
+
+
+class MirrorSelector:
+    # Tracks CDN hosts health, so downloads start from the fastest working mirror
+    def __init__(self, smoothing: float = 0.2, max_error_rate: float = 0.5, error_half_life_sec: float = 60):
+        self.log = logging.getLogger("tikdog.mirrors")
+        self.smoothing = smoothing
+        self.max_error_rate = max_error_rate
+        # Errors are forgotten over time, so a mirror that has failed for a while gets another chance
+        self.error_half_life_sec = error_half_life_sec
+        self.stats: dict[str, MirrorStats] = {}
+
+    def host(self, url: str) -> str:
+        return urlsplit(url).hostname or ""
+
+    def error_rate(self, stats: MirrorStats) -> float:
+        if not self.error_half_life_sec:
+            return stats.error_rate
+        return stats.error_rate * 0.5 ** ((time.monotonic() - stats.updated) / self.error_half_life_sec)
+
+    def record(self, url: str, latency: float | None) -> None:
+        # latency is None for failed downloads
+        stats = self.stats.setdefault(self.host(url), MirrorStats())
+        a = self.smoothing if stats.requests else 1.0
+        failed = latency is None
+        stats.error_rate = self.error_rate(stats) * (1 - a) + a * failed
+        stats.updated = time.monotonic()
+        if latency is not None:
+            stats.latency = latency if not stats.latency else stats.latency * (1 - a) + a * latency
+        stats.requests += 1
+        if failed:
+            self.log.debug(f"{self.host(url)} failed, error rate {stats.error_rate:.2f}")
+
+    def healthy(self, url: str) -> bool:
+        stats = self.stats.get(self.host(url))
+        return stats is None or self.error_rate(stats) < self.max_error_rate
+
+    def sort(self, urls: list[str]) -> list[str]:
+        # Healthy first, then the fastest. Unknown hosts go first to get measured,
+        # the ones that have never worked go first as well once they recover.
+        def key(url: str) -> tuple[bool, float]:
+            stats = self.stats.get(self.host(url))
+            if stats is None:
+                return (False, 0.0)
+            return (not self.healthy(url), stats.latency)
+
+        return sorted(urls, key=key)
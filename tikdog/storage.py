@@ -7,23 +7,39 @@ class Storage:
     def __init__(self):
         self.tg_synced = False
         self.posts: dict[int, CombinedPost] = {}
+        # Posts of the fetch in progress, or of an unfinished one. They are all newer than self.posts
+        # and are moved there by merge(), once the fetch reaches known posts.
+        self.incoming: dict[int, CombinedPost] = {}
+        # TikTok ID -> Telegram post, to link posts that are added later
+        self.tg_posts: dict[int, ParsedTelegramPost] = {}
 
     def __contains__(self, id_) -> bool:
-        return id_ in self.posts
+        return id_ in self.incoming or id_ in self.posts
 
     def __getitem__(self, id_) -> CombinedPost:
+        if id_ in self.incoming:
+            return self.incoming[id_]
         return self.posts[id_]
 
     def __iter__(self) -> Iterator:
-        return list(self.posts.values()).__iter__()
+        return [*self.incoming.values(), *self.posts.values()].__iter__()
+
+    def __len__(self) -> int:
+        return len(self.incoming) + len(self.posts)
 
     def add(self, posts: ParsedTikTokPost | list[ParsedTikTokPost]) -> None:
         # No existence check as TikTok handler does that
+        self.extend(posts)
+        self.merge()
+
+    def extend(self, posts: ParsedTikTokPost | list[ParsedTikTokPost]) -> list[CombinedPost]:
+        # Posts must be older than the ones from previous extend() calls.
+        # That's the order TikTok returns them, page by page.
         if isinstance(posts, ParsedTikTokPost):
             posts = [posts]
-        # Keep new -> old order
-        self.posts = {
-            p.id_: CombinedPost(
+        added = []
+        for p in posts:
+            comb_post = CombinedPost(
                 _raw_tt=p,
                 _raw_tg=None,
                 telegram_id=0,
@@ -34,19 +50,33 @@ class Storage:
                 liked=p.liked,
                 favorited=p.favorited,
             )
-            for p in posts
-        } | self.posts
+            tg_post = self.tg_posts.get(p.id_)
+            if tg_post:
+                comb_post._raw_tg = tg_post
+                comb_post.telegram_id = tg_post.id_
+            self.incoming[p.id_] = comb_post
+            added.append(comb_post)
+        return added
+
+    def merge(self) -> None:
+        # Keep new -> old order
+        if self.incoming:
+            self.posts = self.incoming | self.posts
+            self.incoming = {}
 
     def link_with_tg(self, posts: ParsedTelegramPost | list[ParsedTelegramPost]) -> None:
         if isinstance(posts, ParsedTelegramPost):
             posts = [posts]
         for tg_post in posts:
-            comb_post = self.posts.get(tg_post.tiktok_id)
-            if comb_post:
+            if not tg_post.tiktok_id:
+                continue
+            self.tg_posts[tg_post.tiktok_id] = tg_post
+            if tg_post.tiktok_id in self:
+                comb_post = self[tg_post.tiktok_id]
                 comb_post._raw_tg = tg_post
                 comb_post.telegram_id = tg_post.id_
 
     def unposted(self) -> list[CombinedPost]:
         # new -> old
-        unp = [p for p in self.posts.values() if not p.telegram_id]
+        unp = [p for p in self if not p.telegram_id]
         return unp
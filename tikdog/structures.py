@@ -1,16 +1,34 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Literal
 
 
+@dataclass
+class VideoVariant:
+    urls: list[str]
+    bitrate: int
+    width: int
+    height: int
+    # In bytes, 0 if unknown
+    size: int = 0
+
+    @property
+    def resolution(self) -> int:
+        # "720p" means the short side, regardless of orientation
+        return min(self.width, self.height)
+
+
 @dataclass
 class DownloadTask:
     post_id: int
     type_: Literal["photo", "video", "music"]
     number: int
-    download_url: str
+    # Either a single URL or a list of mirrors
+    download_url: str | list[str]
     media_name: str | None = None
     media_cover_url: str | None = None
     media_format: Literal["mp3", "m4a"] | None = None
+    # Other qualities of the same video
+    variants: list[VideoVariant] = field(default_factory=list)
 
     @property
     def filename(self) -> str:
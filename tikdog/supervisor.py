@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import sys
+import tomllib
+from dataclasses import dataclass
+
+import httpx
+from telethon import TelegramClient
+
+from tikdog import watchdog
+from tikdog.bandwidth import BandwidthPolicy
+from tikdog.media import MediaStore
+from tikdog.mirrors import MirrorSelector
+from tikdog.storage import Storage
+from tikdog.telegram import Telegram
+from tikdog.tiktok import TikTok, create_client
+from tikdog.waf import WafSolver
+
+log = logging.getLogger("tikdog.supervisor")
+
+
+@dataclass
+class AccountConfig:
+    username: str
+    cookie: str
+    device_id: str
+    channel_id: int
+
+
+@dataclass
+class SupervisorConfig:
+    app_id: int
+    app_hash: str
+    bot_token: str
+    accounts: list[AccountConfig]
+    media_memory_limit: int = 0
+    # How many accounts can post at once. Accounts take turns, so a long backfill
+    # of one account doesn't hold back new posts of others.
+    concurrent_posts: int = 1
+    request_delay_sec: float = 5
+    stream_posting: bool = False
+    # Download settings, shared by all accounts. Zero means no limit.
+    race_mirrors: bool = False
+    max_bytes_per_sec: int = 0
+    daily_quota: int = 0
+    max_resolution: int = 0
+    max_file_size: int = 0
+    post_download_concurrency: int = 4
+    download_concurrency: int = 8
+
+
+def load_config(path: str) -> SupervisorConfig:
+    with open(path, "rb") as inf:
+        raw = tomllib.load(inf)
+    # The bot is shared, so it could be set once in .env as well
+    tg = raw.get("telegram", {})
+    app_id = tg.get("app_id", watchdog.tg_app_id)
+    app_hash = tg.get("app_hash", watchdog.tg_app_hash)
+    bot_token = tg.get("bot_token", watchdog.tg_bot_token)
+    if not app_id or not app_hash or not bot_token:
+        raise RuntimeError("Telegram bot parameters are not set!")
+    accounts = [
+        AccountConfig(
+            username=str(a["username"]),
+            cookie=str(a["cookie"]),
+            device_id=str(a["device_id"]),
+            channel_id=int(a["channel_id"]),
+        )
+        for a in raw.get("accounts", [])
+    ]
+    if not accounts:
+        raise RuntimeError("No accounts configured!")
+    return SupervisorConfig(
+        app_id=int(app_id),
+        app_hash=str(app_hash),
+        bot_token=str(bot_token),
+        accounts=accounts,
+        media_memory_limit=int(raw.get("media_memory_limit_mb", watchdog.media_memory_limit_mb)) * 1024 * 1024,
+        concurrent_posts=int(raw.get("concurrent_posts", 1)),
+        request_delay_sec=float(raw.get("request_delay_sec", 5)),
+        stream_posting=bool(raw.get("stream_posting", watchdog.tt_stream_posting)),
+        race_mirrors=bool(raw.get("race_mirrors", watchdog.tt_race_mirrors)),
+        max_bytes_per_sec=int(raw.get("max_kb_per_sec", watchdog.tt_max_kb_per_sec)) * 1024,
+        daily_quota=int(raw.get("daily_quota_mb", watchdog.tt_daily_quota_mb)) * 1024 * 1024,
+        max_resolution=int(raw.get("max_resolution", watchdog.tt_max_resolution)),
+        max_file_size=int(raw.get("max_video_mb", watchdog.tt_max_video_mb)) * 1024 * 1024,
+        post_download_concurrency=int(raw.get("post_download_concurrency", watchdog.tt_post_download_concurrency)),
+        download_concurrency=int(raw.get("download_concurrency", watchdog.tt_download_concurrency)),
+    )
+
+
+async def supervise(config: SupervisorConfig, http: httpx.AsyncClient, bot: TelegramClient, rounds: int = 0) -> None:
+    # Everything except the post storage is shared between accounts
+    media = MediaStore(memory_limit=config.media_memory_limit)
+    waf = WafSolver()
+    mirrors = MirrorSelector()
+    bandwidth = BandwidthPolicy(
+        max_bytes_per_sec=config.max_bytes_per_sec,
+        daily_quota=config.daily_quota,
+        max_resolution=config.max_resolution,
+        max_file_size=config.max_file_size,
+    )
+    download_limit = asyncio.Semaphore(config.download_concurrency)
+    post_slots = asyncio.Semaphore(config.concurrent_posts)
+
+    async def run_dog(account: AccountConfig) -> None:
+        storage = Storage()
+        tt = TikTok(
+            account.username,
+            account.cookie,
+            account.device_id,
+            storage,
+            media=media,
+            client=http,
+            waf=waf,
+            mirrors=mirrors,
+        )
+        tt.request_delay_sec = config.request_delay_sec
+        watchdog.tune(tt, config.race_mirrors, bandwidth, config.post_download_concurrency, download_limit)
+        tg = Telegram(
+            config.app_id, config.app_hash, config.bot_token, account.channel_id, storage, client=bot, media=media
+        )
+        try:
+            await watchdog.walk(storage, tt, tg, rounds=rounds, post_slots=post_slots, stream=config.stream_posting)
+        except Exception:
+            # Don't take other accounts down
+            log.exception(f"Dog for {account.username} has died")
+
+    log.info(f"Supervising {len(config.accounts)} accounts")
+    await asyncio.gather(*(run_dog(account) for account in config.accounts))
+
+
+async def run(config_path: str) -> None:
+    config = load_config(config_path)
+    bot = TelegramClient("bot", config.app_id, config.app_hash)
+    await bot.start(bot_token=config.bot_token)  # type: ignore
+    async with create_client() as http:
+        await supervise(config, http, bot)
+
+
+def main() -> None:
+    config_path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("TIKDOG_CONFIG", "tikdog.toml")
+    asyncio.run(run(config_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from typing import Any, AsyncGenerator
 from telethon import TelegramClient
 from telethon.tl.custom.message import Message
 
+from tikdog.media import MediaStore
 from tikdog.storage import Storage
 from tikdog.structures import ParsedTelegramPost, CombinedPost
 
@@ -16,17 +17,28 @@ class Telegram:
     TEMPLATE_LIKED = ("**lkd:** `", "`")
     TEMPLATE_FAVORITED = ("**fav:** `", "`")
 
-    def __init__(self, app_id: int, app_hash: str, bot_token: str, channel_id: int, storage: Storage):
+    def __init__(
+        self,
+        app_id: int,
+        app_hash: str,
+        bot_token: str,
+        channel_id: int,
+        storage: Storage,
+        client: TelegramClient | None = None,
+        media: MediaStore | None = None,
+    ):
         self.storage = storage
         self.log = logging.getLogger("tikdog.telegram")
         self.bot_token = bot_token
         self.channel_id = channel_id
-        self.bot = TelegramClient("bot", app_id, app_hash)
+        self.bot = client if client is not None else TelegramClient("bot", app_id, app_hash)
         self.RE_POST_ID = self.create_regex(self.TEMPLATE_POST_ID)
         self.RE_URL = self.create_regex(self.TEMPLATE_LINK)
         self.RE_LIKED = self.create_regex(self.TEMPLATE_LIKED)
         self.RE_FAVORITED = self.create_regex(self.TEMPLATE_FAVORITED)
         self.posts: dict[int, ParsedTelegramPost] = {}
+        # Should be shared with TikTok, as it's the one filling it
+        self.media = media if media is not None else MediaStore()
         self.allowed_empty_posts = 30
 
     def create_regex(self, template: tuple[str, str]) -> re.Pattern:
@@ -156,7 +168,6 @@ class Telegram:
         self.storage.link_with_tg(list(self.posts.values()))
 
     async def post(self, item: CombinedPost) -> CombinedPost:
-        data_dir = "tmp"
         if item.telegram_id:
             raise RuntimeError("Already posted")
         self.log.info(f"Posting {item.tiktok_type} {item.tiktok_id}")
@@ -167,18 +178,17 @@ class Telegram:
             f"{self.TEMPLATE_LIKED[0]}{item.liked}{self.TEMPLATE_LIKED[1]}\n"
             f"{self.TEMPLATE_FAVORITED[0]}{item.favorited}{self.TEMPLATE_FAVORITED[1]}"
         )
-        filenames_sorted = []
-        filenames = [
-            f"{data_dir}/{f}" for f in os.listdir(data_dir) if f.startswith(f"{item.tiktok_id}_") and "music" not in f
-        ]
-        filenames_sorted = sorted(filenames, key=lambda s: int(s.split(".")[0].split("_")[1]))
-        msgs = await self.bot.send_file(channel, filenames_sorted, caption=text)  # type: ignore
+        uploads = self.media.uploads(item.tiktok_id)
+        if not uploads:
+            # Not fetched through our media store, but could still be on disk
+            paths = [(t.filename, self.media.path(t)) for t in item.media]
+            uploads = [(filename, path) for filename, path in paths if os.path.exists(path)]
+        files = [f for filename, f in uploads if "music" not in filename]
+        msgs = await self.bot.send_file(channel, files, caption=text)  # type: ignore
         sent_w_caption = self.parse_message(msgs[0])
         item._raw_tg = sent_w_caption
         item.telegram_id = sent_w_caption.id_
-        music_files = [
-            f"{data_dir}/{f}" for f in os.listdir(data_dir) if f.startswith(f"{item.tiktok_id}_") and "music" in f
-        ]
+        music_files = [f for filename, f in uploads if "music" in filename]
         if music_files:
             await self.bot.send_file(channel, music_files)  # type: ignore
         return item
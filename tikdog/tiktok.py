@@ -1,11 +1,12 @@
 import asyncio
-import base64
-import hashlib
+import contextlib
+import http.cookiejar
+import io
 import json
 import logging
-import os
 import re
-from typing import Any, AsyncGenerator, Literal
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Literal
 from urllib.parse import urlencode
 
 import httpx
@@ -13,12 +14,34 @@ from mutagen.id3._frames import APIC, TIT2
 from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4, MP4Cover
 
+from tikdog.bandwidth import BandwidthPolicy
+from tikdog.media import MediaStore
+from tikdog.mirrors import MirrorSelector
 from tikdog.storage import Storage
-from tikdog.structures import DownloadTask, ParsedTikTokPost
+from tikdog.structures import CombinedPost, DownloadTask, ParsedTikTokPost, VideoVariant
+from tikdog.waf import WafSolver
+
+
+def create_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    # A client to be shared by several accounts. Cookies are never stored, as every
+    # account sends its own ones.
+    no_cookies = http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return httpx.AsyncClient(follow_redirects=True, transport=transport, cookies=no_cookies)
 
 
 class TikTok:
-    def __init__(self, username: str, browser_cookie: str, device_id: str, storage: Storage):
+    def __init__(
+        self,
+        username: str,
+        browser_cookie: str,
+        device_id: str,
+        storage: Storage,
+        transport: httpx.AsyncBaseTransport | None = None,
+        media: MediaStore | None = None,
+        client: httpx.AsyncClient | None = None,
+        waf: WafSolver | None = None,
+        mirrors: MirrorSelector | None = None,
+    ):
         self.log = logging.getLogger("tikdog.tiktok")
         self.storage = storage
         self.username = username
@@ -60,64 +83,48 @@ class TikTok:
         }
         self.sec_uid = ""
         self.fetch_block_size = 25
-        self.posts: dict[int, ParsedTikTokPost] = {}
-        self.request_delay_sec = 5
+        self.request_delay_sec: float = 5
+        # Pages of new favorites to look up before posting liked ones in stream mode
+        self.favorite_prescan_pages = 5
+        # Feed -> cursor of the page to continue an unfinished fetch from
+        self.resume_cursors: dict[str, int] = {}
+        # Custom transport, e.g. for routing requests to local stand-ins
+        self.transport = transport
+        # Connection pool shared between accounts, see create_client()
+        self.client = client
+        self.waf = waf if waf is not None else WafSolver()
+        # Should be shared with Telegram, so it can find downloaded files
+        self.media = media if media is not None else MediaStore()
+        # Mirrors health, can be shared between accounts as well
+        self.mirrors = mirrors if mirrors is not None else MirrorSelector()
+        # Download from the two best mirrors at once, keeping the one that answers first
+        self.race_mirrors = False
+        self.bandwidth = BandwidthPolicy()
+        # Concurrent media downloads, per post and for everything this account downloads
+        self.post_download_concurrency = 4
+        self.download_limit = asyncio.Semaphore(8)
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[httpx.AsyncClient]:
+        # Shared client if there is one, otherwise a fresh one for every request
+        if self.client is not None:
+            yield self.client
+        else:
+            async with httpx.AsyncClient(follow_redirects=True, transport=self.transport) as cli:
+                yield cli
 
     async def request(
         self, method: Literal["GET", "POST"], url: str, headers: dict[str, str] | None = None
     ) -> httpx.Response:
         if headers is None:
             headers = {}
-        async with httpx.AsyncClient(follow_redirects=True) as cli:
+        async with self.session() as cli:
             req_headers = {**self.browser_headers, **headers}
-            resp = await cli.request(method, url, headers=req_headers)
-            if (
-                resp.status_code == 200
-                and "text/html" in resp.headers.get("Content-Type", "")
-                and "SlardarWAF" in resp.text
-                and 'id="cs"' in resp.text
-            ):  # WAF
-                m_wci = re.search(r'<p id="wci" class="([^"]*)"', resp.text)
-                m_cs = re.search(r'<p id="cs" class="([^"]*)"', resp.text)
-                if not m_wci or not m_cs:
-                    raise RuntimeError("WAF challenge HTML is missing wci/cs fields")
-                cookie_name = m_wci.group(1)
-                cs_b64 = m_cs.group(1)
-
-                m_rci = re.search(r'<p id="rci" class="([^"]*)"', resp.text)
-                m_rs = re.search(r'<p id="rs" class="([^"]*)"', resp.text)
-                rci = m_rci.group(1) if m_rci else ""
-                rs = m_rs.group(1) if m_rs else ""
-
-                def _b64d(s: str) -> bytes:
-                    return base64.b64decode(s + "=" * (-len(s) % 4))
-
-                c = json.loads(_b64d(cs_b64))
-                prefix = _b64d(c["v"]["a"])
-                expected = _b64d(c["v"]["c"]).hex()
-
-                self.log.info(f"  solving WAF challenge (cookie={cookie_name})...")
-                solution = None
-                for i in range(1_000_001):
-                    h = hashlib.sha256(prefix + str(i).encode()).hexdigest()
-                    if h == expected:
-                        solution = i
-                        break
-
-                if solution is None:
-                    raise RuntimeError("WAF challenge: no solution found in 0..1_000_000")
-
-                c["d"] = base64.b64encode(str(solution).encode()).decode()
-                cookie_value = base64.b64encode(json.dumps(c, separators=(",", ":")).encode()).decode()
-                waf_cookie = f"{cookie_name}={cookie_value}"
-                if rci and rs:
-                    waf_cookie += f"; {rci}={rs}"
-
-                existing_cookies = req_headers.get("Cookie", "")
-                retry_cookies = f"{existing_cookies}; {waf_cookie}" if existing_cookies else waf_cookie
-                retry_headers = {**req_headers, "Cookie": retry_cookies}
-
-                resp2 = await cli.request(method, url, headers=retry_headers)
+            waf_cookie = self.waf.cookie
+            resp = await cli.request(method, url, headers=self.waf.add_cookie(req_headers, waf_cookie))
+            if self.waf.is_challenge(resp):
+                waf_cookie = await self.waf.solve(resp.text, waf_cookie)
+                resp2 = await cli.request(method, url, headers=self.waf.add_cookie(req_headers, waf_cookie))
                 return resp2
             else:
                 return resp
@@ -171,6 +178,7 @@ class TikTok:
         vid = await self.fetch_post_metadata(FISCH_ID)
         try:
             await self.fetch_items(vid)
+            self.delete_items(vid)
             self.log.info("Test video download fine")
             return True
         except RuntimeError:
@@ -183,6 +191,7 @@ class TikTok:
         try:
             vid = await self.fetch_post_metadata_mobile(KITTY_ID)
             await self.fetch_items(vid)
+            self.delete_items(vid)
             self.log.info("Test copyrighted video download fine")
             return True
         except RuntimeError:
@@ -191,59 +200,234 @@ class TikTok:
             )
             return False
 
-    async def fetch_items(self, post: ParsedTikTokPost) -> None:
-        def validate(resp: httpx.Response) -> bool:
-            if resp.status_code != 200:
-                return False
-            if resp.headers.get("Content-Type", "") == "text/html":
-                return False
-            if len(resp.content) < 512:
-                return False
-            return True
+    def validate_headers(self, resp: httpx.Response) -> bool:
+        if resp.status_code != 200:
+            return False
+        if "text/html" in resp.headers.get("Content-Type", ""):
+            return False
+        return True
+
+    def validate_media(self, resp: httpx.Response) -> bool:
+        if not self.validate_headers(resp):
+            return False
+        if len(resp.content) < 512:
+            return False
+        return True
+
+    async def download_from(self, url: str) -> bytes | None:
+        started = time.monotonic()
+        try:
+            resp = await self.request("GET", url)
+        except httpx.HTTPError:
+            self.log.debug(f"failed to download {url}", exc_info=True)
+            resp = None
+        if resp is None or not self.validate_media(resp):
+            self.mirrors.record(url, None)
+            return None
+        self.mirrors.record(url, time.monotonic() - started)
+        return resp.content
+
+    async def is_challenge(self, resp: httpx.Response) -> bool:
+        # For streamed responses. WAF challenges are left to request(), which solves them.
+        if "text/html" not in resp.headers.get("Content-Type", ""):
+            return False
+        try:
+            await resp.aread()
+        except httpx.HTTPError:
+            return False
+        return self.waf.is_challenge(resp)
+
+    async def race(self, urls: list[str]) -> tuple[bytes | None, list[str]]:
+        # Start all downloads, continue with the first mirror that responds properly and drop the others.
+        # Mirrors that have failed are returned as well, the dropped and challenged ones are still worth a try.
+        failed = []
+        async with self.session() as cli:
+            started = time.monotonic()
+            headers = self.waf.add_cookie(self.browser_headers, self.waf.cookie)
+            tasks = {
+                asyncio.create_task(cli.send(cli.build_request("GET", url, headers=headers), stream=True)): url
+                for url in urls
+            }
+            pending = set(tasks)
+            winner: tuple[str, httpx.Response] | None = None
+            try:
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        url = tasks[task]
+                        if task.exception() is not None:
+                            self.mirrors.record(url, None)
+                            failed.append(url)
+                            continue
+                        resp = task.result()
+                        if winner is None and self.validate_headers(resp):
+                            winner = (url, resp)
+                            continue
+                        if winner is None and not await self.is_challenge(resp):
+                            self.mirrors.record(url, None)
+                            failed.append(url)
+                        await resp.aclose()
+            finally:
+                for task in pending:
+                    task.cancel()
+                for res in await asyncio.gather(*pending, return_exceptions=True):
+                    if isinstance(res, httpx.Response):
+                        await res.aclose()
+            if winner is None:
+                return None, failed
+            url, resp = winner
+            try:
+                await resp.aread()
+            except httpx.HTTPError:
+                self.log.debug(f"failed to download {url}", exc_info=True)
+                self.mirrors.record(url, None)
+                return None, [*failed, url]
+            finally:
+                await resp.aclose()
+            if not self.validate_media(resp):
+                self.mirrors.record(url, None)
+                return None, [*failed, url]
+            self.mirrors.record(url, time.monotonic() - started)
+            return resp.content, failed
 
+    async def download(self, urls: list[str]) -> bytes | None:
+        # Go from the best mirror to the worst one, until something works
+        await self.bandwidth.wait()
+        candidates = self.mirrors.sort(urls)
+        # No point in racing against a broken mirror
+        racers = [u for u in candidates if self.mirrors.healthy(u)][:2]
+        if self.race_mirrors and len(racers) > 1:
+            data, failed = await self.race(racers)
+            if data is not None:
+                self.bandwidth.spend(len(data))
+                return data
+            candidates = [u for u in candidates if u not in failed]
+        for url in candidates:
+            data = await self.download_from(url)
+            if data is not None:
+                self.bandwidth.spend(len(data))
+                return data
+        return None
+
+    async def fetch_item(self, web_post: ParsedTikTokPost, item: DownloadTask) -> None:
+        self.log.debug(f"downloading {item.type_} {item.filename}")
+        if not self.media.fetched(item):
+            if isinstance(item.download_url, str):
+                download_urls = [item.download_url]
+            elif isinstance(item.download_url, list):
+                download_urls = item.download_url
+            else:
+                self.log.error(f"Raw post data: {web_post}")
+                raise RuntimeError(f"Unsupported download url type: {type(item.download_url)}")
+            expected_size = 0
+            variant = self.bandwidth.pick_variant(item.variants)
+            if variant:
+                self.log.debug(f"using {variant.resolution}p variant ({variant.size} bytes)")
+                download_urls = variant.urls
+                expected_size = variant.size
+            self.bandwidth.check(expected_size)
+            try:
+                data = await self.download(download_urls)
+            finally:
+                self.bandwidth.release(expected_size)
+            if data is None:
+                raise RuntimeError(f"Failed to download {item.type_} {item.post_id}")
+            self.media.save(item, data)
+        if item.type_ == "music":
+            music_target = self.media.open(item)
+            if item.filename.endswith(".m4a"):
+                music_file = MP4(music_target)
+                assert music_file.tags
+                music_file.tags["\xa9nam"] = item.media_name
+                assert isinstance(item.media_cover_url, str)
+                cover = (await self.request("GET", item.media_cover_url)).content
+                music_file.tags["covr"] = [MP4Cover(data=cover)]
+                music_file.save(music_target)
+            else:
+                music_file = MP3(music_target)
+                assert music_file.tags
+                music_file.tags["TIT2"] = TIT2(encoding=3, text=item.media_name)
+                assert isinstance(item.media_cover_url, str)
+                cover = (await self.request("GET", item.media_cover_url)).content
+                music_file.tags["APIC"] = APIC(encoding=3, mime="image/jpg", type=3, data=cover)
+                music_file.save(music_target)
+            if isinstance(music_target, io.BytesIO):
+                self.media.save(item, music_target.getvalue())
+
+    async def fetch_items(self, post: ParsedTikTokPost) -> None:
         if post.should_not_refetch_via_web:
             web_post = post
         else:
             web_post = await self.fetch_post_metadata(post.id_)
-        data_dir = "tmp"
-        for item in web_post.media:
-            self.log.debug(f"downloading {item.type_} {item.filename}")
-            if not os.path.exists(f"{data_dir}/{item.filename}"):
-                if isinstance(item.download_url, str):
-                    download_url = item.download_url
-                elif isinstance(item.download_url, list):
-                    download_url = item.download_url[0]
-                else:
-                    self.log.error(f"Raw post data: {web_post}")
-                    raise RuntimeError(f"Unsupported download url type: {type(item.download_url)}")
-                resp = await self.request("GET", download_url)
-                if not validate(resp):
-                    raise RuntimeError(f"Failed to download {item.type_} {item.post_id}")
-                with open(f"{data_dir}/{item.filename}", "wb") as outf:
-                    outf.write(resp.content)
-            if item.type_ == "music":
-                if item.filename.endswith(".m4a"):
-                    music_file = MP4(f"{data_dir}/{item.filename}")
-                    assert music_file.tags
-                    music_file.tags["\xa9nam"] = item.media_name
-                    assert isinstance(item.media_cover_url, str)
-                    cover = httpx.get(item.media_cover_url).content
-                    music_file.tags["covr"] = [MP4Cover(data=cover)]
-                    music_file.save()
-                else:
-                    music_file = MP3(f"{data_dir}/{item.filename}")
-                    assert music_file.tags
-                    music_file.tags["TIT2"] = TIT2(encoding=3, text=item.media_name)
-                    assert isinstance(item.media_cover_url, str)
-                    cover = httpx.get(item.media_cover_url).content
-                    music_file.tags["APIC"] = APIC(encoding=3, mime="image/jpg", type=3, data=cover)
-                    music_file.save()
+        self.media.hold(web_post.id_, self.username)
+        # Slideshows have a lot of items, so they are fetched at once. The post fails
+        # as a whole on the first failed item.
+        post_limit = asyncio.Semaphore(self.post_download_concurrency)
+
+        async def fetch_limited(item: DownloadTask) -> None:
+            async with post_limit, self.download_limit:
+                await self.fetch_item(web_post, item)
+
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                for item in web_post.media:
+                    tasks.create_task(fetch_limited(item))
+        except ExceptionGroup as e:
+            # Don't keep items of a failed post around, they are downloaded again on retry
+            self.delete_items(web_post)
+            raise e.exceptions[0] from None
 
     def delete_items(self, post: ParsedTikTokPost) -> None:
-        data_dir = "tmp"
+        if not self.media.release(post.id_, self.username):
+            # Another account sharing the media store still needs them
+            return
         for item in post.media:
-            if os.path.exists(f"{data_dir}/{item.filename}"):
-                os.remove(f"{data_dir}/{item.filename}")
+            self.media.delete(item)
+
+    def parse_variants(self, bitrate_info: list[dict[str, Any]]) -> list[VideoVariant]:
+        variants = []
+        for b in bitrate_info:
+            play_addr = b.get("PlayAddr", {})
+            if not play_addr.get("UrlList"):
+                continue
+            variants.append(
+                VideoVariant(
+                    urls=play_addr["UrlList"],
+                    bitrate=int(b.get("Bitrate", 0)),
+                    width=int(play_addr.get("Width", 0)),
+                    height=int(play_addr.get("Height", 0)),
+                    size=int(play_addr.get("DataSize", 0)),
+                )
+            )
+        return variants
+
+    def parse_variants_mobile(self, bit_rate: list[dict[str, Any]]) -> list[VideoVariant]:
+        variants = []
+        for b in bit_rate:
+            play_addr = b.get("play_addr", {})
+            if not play_addr.get("url_list"):
+                continue
+            variants.append(
+                VideoVariant(
+                    urls=play_addr["url_list"],
+                    bitrate=int(b.get("bit_rate", 0)),
+                    width=int(play_addr.get("width", 0)),
+                    height=int(play_addr.get("height", 0)),
+                    size=int(play_addr.get("data_size", 0)),
+                )
+            )
+        return variants
+
+    def default_video_urls(self, video: dict[str, Any], variants: list[VideoVariant]) -> list[str]:
+        # playAddr is a single URL, but the same stream is listed with its mirrors among the variants
+        play_addr = video["playAddr"]
+        urls = [play_addr]
+        for v in variants:
+            if play_addr in v.urls or (video.get("bitrate") and v.bitrate == int(video["bitrate"])):
+                urls.extend(v.urls)
+                break
+        # downloadAddr isn't used, it's a different (watermarked) file
+        return list(dict.fromkeys(urls))
 
     async def parse_items(self, block_items: list[dict[str, Any]]) -> list[ParsedTikTokPost]:
         items = []
@@ -283,8 +467,15 @@ class TikTok:
                         mobile_item = await self.fetch_post_metadata_mobile(new_item["id_"])
                         items.append(mobile_item)
                         continue
+                    variants = self.parse_variants(item["video"].get("bitrateInfo", []))
                     new_item["media"] = [
-                        DownloadTask(post_id=new_item["id_"], type_="video", number=0, download_url=download_url)
+                        DownloadTask(
+                            post_id=new_item["id_"],
+                            type_="video",
+                            number=0,
+                            download_url=self.default_video_urls(item["video"], variants),
+                            variants=variants,
+                        )
                     ]
                 post = ParsedTikTokPost(**new_item)
                 items.append(post)
@@ -309,7 +500,8 @@ class TikTok:
                         post_id=new_item["id_"],
                         type_="video",
                         number=0,
-                        download_url=item["video"]["play_addr"]["url_list"][0],
+                        download_url=item["video"]["play_addr"]["url_list"],
+                        variants=self.parse_variants_mobile(item["video"].get("bit_rate", [])),
                     )
                 ]
                 post = ParsedTikTokPost(**new_item, should_not_refetch_via_web=True)
@@ -320,10 +512,9 @@ class TikTok:
                 raise
         return items
 
-    async def fetch_liked(self) -> AsyncGenerator[list[dict[str, Any]], None]:
-        # From newest to oldest
+    async def fetch_liked(self, cur: int = 0) -> AsyncGenerator[tuple[list[dict[str, Any]], int], None]:
+        # From newest to oldest. Every page comes with the cursor of the next one.
         cntr = 0
-        cur = 0
         has_more = True
         while has_more:
             params = {**self.browser_params, "secUid": self.sec_uid, "count": 20, "cursor": cur}
@@ -334,13 +525,12 @@ class TikTok:
             has_more = data["hasMore"]
             cntr += len(data["itemList"])
             self.log.debug(f"fetched {len(data['itemList'])} liked posts ({cntr} total), is there more - {has_more}")
-            yield data["itemList"]
-            await asyncio.sleep(5)
+            yield data["itemList"], cur
+            await asyncio.sleep(self.request_delay_sec)
 
-    async def fetch_favorite(self) -> AsyncGenerator[list[dict[str, Any]], None]:
-        # From newest to oldest
+    async def fetch_favorite(self, cur: int = 0) -> AsyncGenerator[tuple[list[dict[str, Any]], int], None]:
+        # From newest to oldest. Every page comes with the cursor of the next one.
         cntr = 0
-        cur = 0
         has_more = True
         while has_more:
             params = {**self.browser_params, "secUid": self.sec_uid, "count": 20, "cursor": cur}
@@ -353,57 +543,106 @@ class TikTok:
             self.log.debug(
                 f"fetched {len(data['itemList'])} favorited posts ({cntr} total), is there more - {has_more}"
             )
-            yield data["itemList"]
-            await asyncio.sleep(5)
-
-    async def update_data(self) -> None:
-        # Return the latest saved post from correct dictionary, creating it if necessary
-        def get_init_if_needs(item: ParsedTikTokPost) -> ParsedTikTokPost:
-            if item.id_ not in self.posts and item.id_ not in new_posts:
-                new_posts[item.id_] = item
-            in_new_posts = new_posts.get(item.id_)
-            if in_new_posts:
-                return in_new_posts
-            in_posts = self.posts.get(item.id_)
-            if in_posts:
-                return in_posts
-            raise KeyError("item should be initialized, but somehow it's not")
+            yield data["itemList"], cur
+            await asyncio.sleep(self.request_delay_sec)
 
-        self.log.info("Fetching new posts")
-        # As the order of posts is the newest -> oldest, we can't just append to the main dict
-        new_posts: dict[int, ParsedTikTokPost] = {}
-        # Probably, all favorited items are liked, so to keep proper order we start with liked ones
-        should_stop = False
-        async for block in self.fetch_liked():
-            parsed_items = await self.parse_items(block)
-            for item in parsed_items:
-                saved = get_init_if_needs(item)
-                if saved.liked:
-                    # Already fetched by this function.
-                    # If the previous order hasn't changed (and it probably shouldn't),
-                    # then this marks that we have reached previous fetch data
-                    self.log.info(f"stopping at {saved.id_} as it's already fetched")
-                    should_stop = True
-                    break
-                saved.liked = True
-            if should_stop:
-                break
-        # However, in case there are a few that are not, we still account for them
-        should_stop = False
-        async for block in self.fetch_favorite():
-            parsed_items = await self.parse_items(block)
-            for item in parsed_items:
-                saved = get_init_if_needs(item)
-                if saved.favorited:
-                    self.log.info(f"stopping at {saved.id_} as it's already fetched")
-                    should_stop = True
+    async def fetch_favorite_ids(self) -> tuple[set[int], bool]:
+        # IDs of favorited posts that are not known yet, including ones of an unfinished walk.
+        # Up to favorite_prescan_pages pages are read, the flag tells whether all new ones were found.
+        ids = set()
+        pages = 0
+        for cur in {0, self.resume_cursors.get("favorite", 0)}:
+            async for block, _ in self.fetch_favorite(cur):
+                pages += 1
+                known = False
+                for item in block:
+                    id_ = int(item["id"])
+                    if id_ in self.storage and self.storage[id_].favorited:
+                        known = True
+                        break
+                    ids.add(id_)
+                if known:
                     break
-                saved.favorited = True
-            if should_stop:
-                break
-        self.log.info(f"Fetched {len(new_posts)} new posts")
+                if pages >= self.favorite_prescan_pages:
+                    return ids, False
+        return ids, True
+
+    async def update_data(self, on_page: Callable[[list[CombinedPost]], None] | None = None) -> None:
+        # Every page goes to storage as soon as it's parsed, so only a single page of raw data is kept
+        # around. on_page gets new posts of every page, e.g. to post them while older ones are fetched.
+        page: list[CombinedPost] = []
+
+        # Return the saved post, adding it to storage if necessary
+        def get_init_if_needs(item: ParsedTikTokPost) -> CombinedPost:
+            if item.id_ not in self.storage:
+                # As the order of posts is the newest -> oldest, they are kept aside until merge()
+                page.extend(self.storage.extend(item))
+            return self.storage[item.id_]
 
-        # Recreate to keep new -> old order
-        self.posts = new_posts | self.posts
+        def commit_page(feed: str) -> int:
+            added = len(page)
+            # Until all new favorites are known, a liked post might still turn out to be favorited.
+            # Such posts are held back, they are left for the caller once the fetch is over.
+            ready = page if feed == "favorite" or favorites_known else [p for p in page if p.favorited]
+            if on_page and ready:
+                on_page(ready.copy())
+            page.clear()
+            return added
 
-        self.storage.add([p for id_, p in self.posts.items() if id_ not in self.storage])
+        # Posts are posted right away with on_page, so their flags must be final by then.
+        # Favorited ones are looked up first, so liked posts come out with proper flags.
+        favorite_ids, favorites_known = await self.fetch_favorite_ids() if on_page else (set(), True)
+
+        async def walk(feed: str) -> int:
+            # Until the walk reaches known posts, fetched ones stay in storage.incoming, and
+            # its cursor is saved. If fetching fails, the next update continues from there.
+            new_count = 0
+            cur = self.resume_cursors.get(feed, 0)
+            if cur:
+                self.log.info(f"Resuming unfinished fetch of {feed} posts")
+            fetch = self.fetch_liked if feed == "liked" else self.fetch_favorite
+            should_stop = False
+            async for block, next_cur in fetch(cur):
+                parsed_items = await self.parse_items(block)
+                # Raw data isn't needed anymore
+                block.clear()
+                for item in parsed_items:
+                    saved = get_init_if_needs(item)
+                    if feed == "liked":
+                        known = saved.liked
+                    else:
+                        # Favorited posts looked up in advance are already marked
+                        known = saved.favorited and item.id_ not in favorite_ids
+                    if known:
+                        # Already fetched by this function.
+                        # If the previous order hasn't changed (and it probably shouldn't),
+                        # then this marks that we have reached previous fetch data
+                        self.log.info(f"stopping at {saved.tiktok_id} as it's already fetched")
+                        should_stop = True
+                        break
+                    if feed == "liked":
+                        saved.liked = True
+                    if feed == "favorite" or item.id_ in favorite_ids:
+                        saved.favorited = True
+                    if saved._raw_tt:
+                        saved._raw_tt.liked = saved.liked
+                        saved._raw_tt.favorited = saved.favorited
+                new_count += commit_page(feed)
+                self.resume_cursors[feed] = next_cur
+                if should_stop:
+                    break
+            self.resume_cursors.pop(feed, None)
+            # Put fetched ones in front to keep new -> old order
+            self.storage.merge()
+            return new_count
+
+        self.log.info("Fetching new posts")
+        new_count = 0
+        # Unfinished walks go first, as their posts are older than anything new
+        for feed in [f for f in ("liked", "favorite") if f in self.resume_cursors]:
+            new_count += await walk(feed)
+        # Probably, all favorited items are liked, so to keep proper order we start with liked ones.
+        # However, in case there are a few that are not, we still account for them.
+        new_count += await walk("liked")
+        new_count += await walk("favorite")
+        self.log.info(f"Fetched {new_count} new posts")
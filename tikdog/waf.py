@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import re
+
+import httpx
+
+
+class WafSolver:
+    # Solves TikTok WAF challenges. The solved cookie is remembered and sent with the following
+    # requests, so it can be shared between accounts instead of solving the challenge every time.
+    def __init__(self):
+        self.log = logging.getLogger("tikdog.waf")
+        self.cookie = ""
+        self.lock = asyncio.Lock()
+
+    def is_challenge(self, resp: httpx.Response) -> bool:
+        return (
+            resp.status_code == 200
+            and "text/html" in resp.headers.get("Content-Type", "")
+            and "SlardarWAF" in resp.text
+            and 'id="cs"' in resp.text
+        )
+
+    def add_cookie(self, headers: dict[str, str], waf_cookie: str) -> dict[str, str]:
+        if not waf_cookie:
+            return headers
+        existing_cookies = headers.get("Cookie", "")
+        cookies = f"{existing_cookies}; {waf_cookie}" if existing_cookies else waf_cookie
+        return {**headers, "Cookie": cookies}
+
+    def solve_challenge(self, html: str) -> str:
+        m_wci = re.search(r'<p id="wci" class="([^"]*)"', html)
+        m_cs = re.search(r'<p id="cs" class="([^"]*)"', html)
+        if not m_wci or not m_cs:
+            raise RuntimeError("WAF challenge HTML is missing wci/cs fields")
+        cookie_name = m_wci.group(1)
+        cs_b64 = m_cs.group(1)
+
+        m_rci = re.search(r'<p id="rci" class="([^"]*)"', html)
+        m_rs = re.search(r'<p id="rs" class="([^"]*)"', html)
+        rci = m_rci.group(1) if m_rci else ""
+        rs = m_rs.group(1) if m_rs else ""
+
+        def _b64d(s: str) -> bytes:
+            return base64.b64decode(s + "=" * (-len(s) % 4))
+
+        c = json.loads(_b64d(cs_b64))
+        prefix = _b64d(c["v"]["a"])
+        expected = _b64d(c["v"]["c"]).hex()
+
+        self.log.info(f"  solving WAF challenge (cookie={cookie_name})...")
+        solution = None
+        for i in range(1_000_001):
+            h = hashlib.sha256(prefix + str(i).encode()).hexdigest()
+            if h == expected:
+                solution = i
+                break
+
+        if solution is None:
+            raise RuntimeError("WAF challenge: no solution found in 0..1_000_000")
+
+        c["d"] = base64.b64encode(str(solution).encode()).decode()
+        cookie_value = base64.b64encode(json.dumps(c, separators=(",", ":")).encode()).decode()
+        waf_cookie = f"{cookie_name}={cookie_value}"
+        if rci and rs:
+            waf_cookie += f"; {rci}={rs}"
+        return waf_cookie
+
+    async def solve(self, html: str, used_cookie: str) -> str:
+        # used_cookie is the one that got the challenge. If someone else has already solved
+        # a newer challenge while we were waiting, just reuse it.
+        async with self.lock:
+            if self.cookie != used_cookie:
+                return self.cookie
+            # Brute forcing takes a while, don't block other accounts meanwhile
+            self.cookie = await asyncio.to_thread(self.solve_challenge, html)
+            return self.cookie
@@ -1,10 +1,14 @@
 import asyncio
+import contextlib
 import logging
 import os
 
 from dotenv import load_dotenv
 
+from tikdog.bandwidth import BandwidthPolicy
+from tikdog.media import MediaStore
 from tikdog.storage import Storage
+from tikdog.structures import CombinedPost
 from tikdog.telegram import Telegram
 from tikdog.tiktok import TikTok
 
@@ -21,11 +25,49 @@ tg_app_hash = os.environ.get("TG_APP_HASH")
 tg_bot_token = os.environ.get("TG_BOT_TOKEN")
 tg_channel_id = os.environ.get("TG_CHANNEL_ID")
 
+# Keep downloaded media in memory up to this size instead of writing it to disk
+media_memory_limit_mb = os.environ.get("MEDIA_MEMORY_LIMIT_MB", "0")
+# Download from two CDN mirrors at once, keeping the faster one
+tt_race_mirrors = os.environ.get("TT_RACE_MIRRORS", "") in ("1", "true", "True")
+# Bandwidth policy, zero means no limit
+tt_max_kb_per_sec = os.environ.get("TT_MAX_KB_PER_SEC", "0")
+tt_daily_quota_mb = os.environ.get("TT_DAILY_QUOTA_MB", "0")
+tt_max_resolution = os.environ.get("TT_MAX_RESOLUTION", "0")
+tt_max_video_mb = os.environ.get("TT_MAX_VIDEO_MB", "0")
+# Concurrent media downloads within a single post and in total
+tt_post_download_concurrency = os.environ.get("TT_POST_DOWNLOAD_CONCURRENCY", "4")
+tt_download_concurrency = os.environ.get("TT_DOWNLOAD_CONCURRENCY", "8")
+# Start posting while older TikTok pages are still being fetched
+tt_stream_posting = os.environ.get("TT_STREAM_POSTING", "") in ("1", "true", "True")
+
 log = logging.getLogger("tikdog.dog")
 
 SLEEP_TIME_SECS = 1800
 
 
+def bandwidth_policy() -> BandwidthPolicy:
+    return BandwidthPolicy(
+        max_bytes_per_sec=int(tt_max_kb_per_sec) * 1024,
+        daily_quota=int(tt_daily_quota_mb) * 1024 * 1024,
+        max_resolution=int(tt_max_resolution),
+        max_file_size=int(tt_max_video_mb) * 1024 * 1024,
+    )
+
+
+def tune(
+    tt: TikTok,
+    race_mirrors: bool,
+    bandwidth: BandwidthPolicy,
+    post_download_concurrency: int,
+    download_limit: asyncio.Semaphore,
+) -> None:
+    # Download settings. Bandwidth and download limit can be shared between accounts.
+    tt.race_mirrors = race_mirrors
+    tt.bandwidth = bandwidth
+    tt.post_download_concurrency = post_download_concurrency
+    tt.download_limit = download_limit
+
+
 async def dog() -> None:
     # Yeah, type checker. Get it.
     if (
@@ -39,8 +81,33 @@ async def dog() -> None:
     ):
         raise RuntimeError("Not all required parameters are set!")
     storage = Storage()
-    tt = TikTok(tt_username, tt_cookie, tt_device_id, storage)
-    tg = Telegram(int(tg_app_id), tg_app_hash, tg_bot_token, int(tg_channel_id), storage)
+    media = MediaStore(memory_limit=int(media_memory_limit_mb) * 1024 * 1024)
+    tt = TikTok(tt_username, tt_cookie, tt_device_id, storage, media=media)
+    tune(
+        tt,
+        tt_race_mirrors,
+        bandwidth_policy(),
+        int(tt_post_download_concurrency),
+        asyncio.Semaphore(int(tt_download_concurrency)),
+    )
+    tg = Telegram(int(tg_app_id), tg_app_hash, tg_bot_token, int(tg_channel_id), storage, media=media)
+    await walk(storage, tt, tg, stream=tt_stream_posting)
+
+
+async def walk(
+    storage: Storage,
+    tt: TikTok,
+    tg: Telegram,
+    rounds: int = 0,
+    post_slots: asyncio.Semaphore | None = None,
+    stream: bool = False,
+) -> None:
+    # rounds == 0 means "forever", anything else is used by benchmarks to stop the dog.
+    # post_slots is shared by dogs running in one process, so they take turns in posting.
+    # stream starts posting as soon as the first TikTok page is fetched. Pages come from
+    # the newest to the oldest, so the first sync won't keep "as in TikTok" order. A few
+    # pages of new favorites are looked up before that, so posts go out with proper flags.
+    # If there are more, the posts that might still be favorited wait for the end of the sync.
     await tt.connect()
     await tg.connect()
 
@@ -48,32 +115,67 @@ async def dog() -> None:
         return
     await tt.check_copyrighted_video_download()
 
-    # First - fetch full TikTok data. It is used as a base for combined storage.
-    # This can take a while.
-    await tt.update_data()
-    # Afterwards follow with Telegram update to prevent double posting.
-    # Better to use new -> old scan as order doesn't matter for it, and
-    # automatically fetch last post ID.
-    await tg.update_data(max_count=0, reverse=True, determine_last_id=True)
+    if stream:
+        # Telegram goes first, storage links TikTok posts with it as they come
+        await tg.update_data(max_count=0, reverse=True, determine_last_id=True)
+    else:
+        # First - fetch full TikTok data. It is used as a base for combined storage.
+        # This can take a while.
+        await tt.update_data()
+        # Afterwards follow with Telegram update to prevent double posting.
+        # Better to use new -> old scan as order doesn't matter for it, and
+        # automatically fetch last post ID.
+        await tg.update_data(max_count=0, reverse=True, determine_last_id=True)
+
+    async def post_all(posts: list[CombinedPost]) -> None:
+        for post in posts[::-1]:
+            # Should be reversed, as it's stored in new -> old order, to prevent
+            # breaking the "as in TikTok" order
+            if post.telegram_id:
+                continue
+            assert post._raw_tt
+            async with post_slots or contextlib.nullcontext():
+                await tt.fetch_items(post._raw_tt)
+                await tg.post(post)
+                tt.delete_items(post._raw_tt)
+
+    async def stream_pages() -> None:
+        pages: asyncio.Queue[list[CombinedPost] | None] = asyncio.Queue()
+
+        async def fetch() -> None:
+            try:
+                await tt.update_data(on_page=pages.put_nowait)
+            finally:
+                pages.put_nowait(None)
+
+        fetching = asyncio.create_task(fetch())
+        try:
+            while (page := await pages.get()) is not None:
+                await post_all(page)
+            await fetching
+        finally:
+            fetching.cancel()
+            await asyncio.gather(fetching, return_exceptions=True)
 
     # Main loop. Update TikTok data (what will fetch only new posts), then post
     # them to Telegram. As corresponding objects will be updated, no need to
     # update Telegram data.
+    done_rounds = 0
     while True:
         try:
-            await tt.update_data()
-
-            for post in storage.unposted()[::-1]:
-                # Should be reversed, as it's stored in new -> old order, to prevent
-                # breaking the "as in TikTok" order
-                assert post._raw_tt
-                await tt.fetch_items(post._raw_tt)
-                await tg.post(post)
-                tt.delete_items(post._raw_tt)
+            if stream:
+                await stream_pages()
+            else:
+                await tt.update_data()
+            # Everything else, including leftovers of failed rounds
+            await post_all(storage.unposted())
 
             log.info(f"Done, sleeping for {SLEEP_TIME_SECS}")
         except Exception as e:
             log.warning("failed to do main loop. sleeping, will retry", exc_info=e)
+        done_rounds += 1
+        if rounds and done_rounds >= rounds:
+            return
         await asyncio.sleep(SLEEP_TIME_SECS)
 
 